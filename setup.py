@@ -4,11 +4,14 @@
 
 import os
 import re
+import shutil
 import subprocess
 
 from setuptools import setup, find_packages
 from setuptools.command.build_py import build_py as build_py_orig
 
+VERSION_RE = re.compile(r"^__VERSION__ = ['\"]([^'\"]*)['\"]", re.M)
+
 
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
@@ -16,7 +19,7 @@ def read(fname):
 
 def find_version(source):
     version_file = read(source)
-    version_match = re.search(r"^__VERSION__ = ['\"]([^'\"]*)['\"]", version_file, re.M)
+    version_match = VERSION_RE.search(version_file)
 
     if version_match:
         return version_match.group(1)
@@ -28,9 +31,13 @@ class BuildGuestInitCommand(build_py_orig):
         def run(self):
             cc = os.getenv("CC", "gcc")
             srcdir = "src/lkvm/guest"
+            compiler = [cc]
+
+            if shutil.which("ccache"):
+                compiler.insert(0, "ccache")
 
-            subprocess.check_call([cc, "-s", "-static", "-Os", "-nostartfiles",
-                                   "-o", f"{srcdir}/init", f"{srcdir}/init.c"])
+            subprocess.check_call(compiler + ["-s", "-static", "-Os", "-nostartfiles",
+                                              "-o", f"{srcdir}/init", f"{srcdir}/init.c"])
             super().run()
 
 NAME = "lkvm"
@@ -1,28 +1,37 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 # Copyright (C) 2024  Alexey Gladkov <legion@kernel.org>
 
+import importlib
 import logging
 import os
 import os.path
-import re
+import signal
 import subprocess
+import time
 
-from typing import Optional, Dict, Tuple, List, Union, Any
-from collections.abc import Iterator
+from typing import Optional, Tuple, List
 
-HAVE_NFS = False
-
-try:
-    import shenaniganfs # type: ignore[import-untyped]
-    HAVE_NFS = True
-except ImportError:
-    pass
+HAVE_NFS: Optional[bool] = None
 
 __VERSION__ = '1-dev'
 
+VM_BASEDIR = os.path.expanduser("~/vm")
+
+ENV = {
+    "home": os.getenv("HOME"),
+    "user": os.getenv("USER"),
+}
+
 EX_SUCCESS = 0 # Successful exit status.
 EX_FAILURE = 1 # Failing exit status.
 
+# Seconds exec_command() waits for the child after Ctrl-C before killing it.
+EXEC_SIGINT_TIMEOUT = 0.25
+
+LOG_FORMAT = "[%(asctime)s] %(message)s"
+LOG_DATEFMT = "%H:%M:%S"
+LOG_FORMATTER = logging.Formatter(fmt=LOG_FORMAT, datefmt=LOG_DATEFMT)
+
 logger = logging.getLogger("lkvm")
 
 
@@ -31,50 +40,88 @@ class Error:
         self.message = message
 
 
+def have_nfs() -> bool:
+    global HAVE_NFS
+
+    if HAVE_NFS is None:
+        # Import the server module itself: a partial shenaniganfs install can
+        # be found but still fail to import.
+        try:
+            importlib.import_module("lkvm.nfs")
+            HAVE_NFS = True
+        except ImportError:
+            HAVE_NFS = False
+
+    return HAVE_NFS
+
+
 def exec_command(cmdargs: List[str]) -> int:
-    ecode = 0
+    logger.debug("executing %s", cmdargs)
     try:
-        res = subprocess.run(cmdargs, check=True)
-        ecode = res.returncode
+        # Python ignores these, restore the defaults for the child like
+        # subprocess does.
+        pid = os.posix_spawnp(cmdargs[0], cmdargs, os.environ,
+                              setsigdef=(signal.SIGPIPE, signal.SIGXFSZ))
 
-    except subprocess.CalledProcessError as e:
-        ecode = e.returncode
+    except FileNotFoundError as e:
+        logger.critical("unable to execute %s: %s", cmdargs[0], e.strerror)
+        return 127
+
+    try:
+        _, status = os.waitpid(pid, 0)
+
+    except KeyboardInterrupt:
+        # The child got the SIGINT as well. Like subprocess.run(), give it
+        # a moment to exit and kill it otherwise.
+        deadline = time.monotonic() + EXEC_SIGINT_TIMEOUT
+
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                raise
+            time.sleep(0.01)
+
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        raise
+
+    ecode = os.waitstatus_to_exitcode(status)
+
+    # Killed by a signal. Report it like a shell does.
+    if ecode < 0:
+        return 128 - ecode
 
     return ecode
 
 
 def run_command(cmdargs: List[str], stdin: Optional[bytes] = None,
                 rundir: Optional[str] = None) -> Tuple[int, bytes, bytes]:
-    if rundir:
-        logger.debug("changing dir to %s", rundir)
-        curdir = os.getcwd()
-        os.chdir(rundir)
-    else:
-        curdir = None
-
-    logger.debug("running %s", cmdargs)
+    logger.debug("running %s (cwd=%s)", cmdargs, rundir)
     try:
-        sp = subprocess.Popen(cmdargs, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        sp = subprocess.Popen(cmdargs, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                              cwd=rundir)
         (output, error) = sp.communicate(input=stdin)
         returncode = sp.returncode
     except FileNotFoundError:
         (returncode, output, error) = (127, b'', b'')
 
-    if curdir:
-        logger.debug("changing back into %s", curdir)
-        os.chdir(curdir)
-
     return returncode, output, error
 
 
-def setup_logger(logger: logging.Logger, level: int, fmt: str) -> logging.Logger:
-    formatter = logging.Formatter(fmt=fmt, datefmt="%H:%M:%S")
+def setup_logger(logger: logging.Logger, level: int, fmt: str = LOG_FORMAT) -> logging.Logger:
+    if fmt == LOG_FORMAT:
+        formatter = LOG_FORMATTER
+    else:
+        formatter = logging.Formatter(fmt=fmt, datefmt=LOG_DATEFMT)
+
+    # Calling this again must not add a second handler.
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
 
-    handler = logging.StreamHandler()
-    handler.setLevel(level)
-    handler.setFormatter(formatter)
+    for handler in logger.handlers:
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
 
     logger.setLevel(level)
-    logger.addHandler(handler)
 
     return logger
@@ -2,29 +2,30 @@
 # Copyright (C) 2024  Alexey Gladkov <legion@kernel.org>
 
 import argparse
+import functools
+import importlib
 import os
 import sys
 import logging
 
+from typing import Optional, Callable, Dict, List, Tuple
+
 import lkvm
-import lkvm.parameters
 
 logger = lkvm.logger
 
 
-def cmd_setup(cmdargs: argparse.Namespace) -> int:
-    import lkvm.command_setup
-    return lkvm.command_setup.main(cmdargs)
+HANDLERS: Dict[str, Callable[[argparse.Namespace], int]] = {}
 
 
-def cmd_list(cmdargs: argparse.Namespace) -> int:
-    import lkvm.command_list
-    return lkvm.command_list.main(cmdargs)
+def dispatch(name: str, cmdargs: argparse.Namespace) -> int:
+    handler = HANDLERS.get(name)
 
+    if handler is None:
+        module = importlib.import_module(f"lkvm.command_{name}")
+        handler = HANDLERS[name] = module.main
 
-def cmd_run(cmdargs: argparse.Namespace) -> int:
-    import lkvm.command_run
-    return lkvm.command_run.main(cmdargs)
+    return handler(cmdargs)
 
 
 def cmd_sandbox(cmdargs: argparse.Namespace) -> int:
@@ -33,12 +34,7 @@ def cmd_sandbox(cmdargs: argparse.Namespace) -> int:
     lkvm.command_run.sandbox_prog = cmdargs.prog
     lkvm.command_run.sandbox_args = cmdargs.args
 
-    return lkvm.command_run.main(cmdargs)
-
-
-def cmd_vm(cmdargs: argparse.Namespace) -> int:
-    import lkvm.command_vm
-    return lkvm.command_vm.main(cmdargs)
+    return dispatch("run", cmdargs)
 
 
 def add_common_arguments(parser: argparse.ArgumentParser) -> None:
@@ -57,153 +53,159 @@ def add_common_arguments(parser: argparse.ArgumentParser) -> None:
                         help="show this help message and exit.")
 
 
+# Shared by every subcommand parser through argparse parents.
+COMMON_ARGUMENTS = argparse.ArgumentParser(add_help=False)
+add_common_arguments(COMMON_ARGUMENTS)
+
+
 def add_qemu_arguments(parser: argparse.ArgumentParser) -> None:
+    import lkvm.parameters
     for p in lkvm.parameters.PARAMS:
         p.add_arguments(parser)
 
 
-def setup_parser() -> argparse.ArgumentParser:
-    epilog = "Report bugs to authors."
+def add_setup_arguments(parser: argparse.ArgumentParser) -> None:
+    mode_choices = ["9p", "disk"]
+
+    if lkvm.have_nfs():
+        mode_choices.append("nfs")
 
-    description = """\
+    parser.add_argument("-a", "--arch",
+                        dest="arch", action="store", default=os.uname().machine,
+                        help="target architecture.")
+    parser.add_argument("-m", "--mode",
+                        dest="mode", action="store", default="9p", choices=mode_choices,
+                        help="profile mode (default: %(default)s).")
+    parser.add_argument("profile", help="name of profile")
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('-n', '--dry-run',
+                        dest="dry_run", action='store_true', default=False,
+                        help='show what should be launched.')
+    add_qemu_arguments(parser)
+    parser.add_argument("profile", help="name of profile")
+
+
+def add_sandbox_arguments(parser: argparse.ArgumentParser) -> None:
+    add_run_arguments(parser)
+    parser.add_argument("prog", help="script when booting into custom rootfs")
+    parser.add_argument("args", nargs='*', help="optional <prog> arguments")
+
+
+def add_vm_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--stop',
+                        dest="vm_state", action='store_const', const="stop",
+                        help='Stop guest VM execution.')
+    parser.add_argument('--continue',
+                        dest="vm_state", action='store_const', const="continue",
+                        help='Resume guest VM execution.')
+    parser.add_argument('--quit',
+                        dest="vm_state", action='store_const', const="quit",
+                        help='QEMU process to exit gracefully.')
+    parser.add_argument('--dump-memory',
+                        dest="dump_memory", action='store', metavar='FILE',
+                        help='Dump guest VM memory to FILE.')
+    parser.add_argument("profile", help="name of profile")
+
+
+def find_subcommand(argv: List[str]) -> Optional[str]:
+    # None of the top-level options takes a value, so the first positional
+    # argument is the name of the subcommand.
+    for arg in argv:
+        if not arg.startswith("-"):
+            return arg
+    return None
+
+
+EPILOG = "Report bugs to authors."
+
+DESCRIPTION = """\
 The program to run virtual machines and run programs in their virtual environment.
 """
-    parser = argparse.ArgumentParser(
-            prog="lkvm",
-            formatter_class=argparse.RawTextHelpFormatter,
-            description=description,
-            epilog=epilog,
-            add_help=False,
-            allow_abbrev=True)
-
-    add_common_arguments(parser)
-
-    subparsers = parser.add_subparsers(dest="subcmd", help="")
 
-    # command: setup
-    sp_description = """\
+SUBCOMMANDS: List[Tuple[str, Callable[[argparse.Namespace], int], str,
+                        Optional[Callable[[argparse.ArgumentParser], None]]]] = [
+    ("setup", functools.partial(dispatch, "setup"), """\
 Setup a new virtual machine. This creates a new rootfs in the .vm folder
 of your home directory.
 
-"""
-    sp = subparsers.add_parser("setup",
-                               formatter_class=argparse.RawTextHelpFormatter,
-                               description=sp_description, help=sp_description,
-                               epilog=epilog, add_help=False)
-    sp.set_defaults(func=cmd_setup)
-    add_common_arguments(sp)
-
-    mode_choices = ["9p", "disk"]
-
-    if lkvm.HAVE_NFS:
-        mode_choices.append("nfs")
-
-    sp.add_argument("-a", "--arch",
-                     dest="arch", action="store", default=os.uname().machine,
-                     help="target architecture.")
-    sp.add_argument("-m", "--mode",
-                     dest="mode", action="store", default="9p", choices=mode_choices,
-                     help="profile mode (default: %(default)s).")
-    sp.add_argument("profile", help="name of profile")
+""", add_setup_arguments),
 
-    # command: list
-    sp_description = """\
+    ("list", functools.partial(dispatch, "list"), """\
 Print a list of running instances on the host. This is restricted to instances
 started by the current user, as it looks in the .vm folder in your home
 directory.
 
-"""
-    sp = subparsers.add_parser("list",
-                               formatter_class=argparse.RawTextHelpFormatter,
-                               description=sp_description, help=sp_description,
-                               epilog=epilog, add_help=False)
-    sp.set_defaults(func=cmd_list)
-    add_common_arguments(sp)
-
-    # command: run
-    sp_description = """\
+""", None),
+
+    ("run", functools.partial(dispatch, "run"), """\
 Starts a virtual machine according to specified profile. Once booted, init will
 mount /proc, /sys and invoke bash.
 
-"""
-    sp = subparsers.add_parser("run",
-                               formatter_class=argparse.RawTextHelpFormatter,
-                               description=sp_description, help=sp_description,
-                               epilog=epilog, add_help=False)
-    sp.set_defaults(func=cmd_run)
-    add_common_arguments(sp)
-    sp.add_argument('-n', '--dry-run',
-                     dest="dry_run", action='store_true', default=False,
-                     help='show what should be launched.')
-    add_qemu_arguments(sp)
-    sp.add_argument("profile", help="name of profile")
-
-    # command: sandbox
-    sp_description = """\
+""", add_run_arguments),
+
+    ("sandbox", cmd_sandbox, """\
 Runs a command in a sandboxed guest. vm will inject a special init binary which
 will do an initial setup of the guest Linux and then lauch a shell script with
 the specified command. Upon this command ending, the guest will be shutdown.
 
-"""
-    sp = subparsers.add_parser("sandbox",
-                               formatter_class=argparse.RawTextHelpFormatter,
-                               description=sp_description, help=sp_description,
-                               epilog=epilog, add_help=False)
-    sp.set_defaults(func=cmd_sandbox)
-    add_common_arguments(sp)
-    sp.add_argument('-n', '--dry-run',
-                     dest="dry_run", action='store_true', default=False,
-                     help='show what should be launched.')
-    add_qemu_arguments(sp)
-    sp.add_argument("profile", help="name of profile")
-    sp.add_argument("prog", help="script when booting into custom rootfs")
-    sp.add_argument("args", nargs='*', help="optional <prog> arguments")
-
-    # command: crash
-    sp_description = """\
+""", add_sandbox_arguments),
+
+    ("vm", functools.partial(dispatch, "vm"), """\
 Controls the VM state (start, stop, pause, etc.).
 
-"""
-    sp = subparsers.add_parser("vm",
-                               formatter_class=argparse.RawTextHelpFormatter,
-                               description=sp_description, help=sp_description,
-                               epilog=epilog, add_help=False)
-    sp.set_defaults(func=cmd_vm)
-    add_common_arguments(sp)
-    sp.add_argument('--stop',
-                     dest="vm_state", action='store_const', const="stop",
-                     help='Stop guest VM execution.')
-    sp.add_argument('--continue',
-                     dest="vm_state", action='store_const', const="continue",
-                     help='Resume guest VM execution.')
-    sp.add_argument('--quit',
-                     dest="vm_state", action='store_const', const="quit",
-                     help='QEMU process to exit gracefully.')
-    sp.add_argument('--dump-memory',
-                     dest="dump_memory", action='store', metavar='FILE',
-                     help='Dump guest VM memory to FILE.')
-    sp.add_argument("profile", help="name of profile")
+""", add_vm_arguments),
+]
+
+
+def setup_parser(argv: List[str]) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+            prog="lkvm",
+            formatter_class=argparse.RawTextHelpFormatter,
+            description=DESCRIPTION,
+            epilog=EPILOG,
+            add_help=False,
+            allow_abbrev=True)
+
+    add_common_arguments(parser)
+
+    subparsers = parser.add_subparsers(dest="subcmd", help="")
+
+    subcmd = find_subcommand(argv)
+
+    for name, func, description, add_arguments in SUBCOMMANDS:
+        sp = subparsers.add_parser(name,
+                                   formatter_class=argparse.RawTextHelpFormatter,
+                                   description=description, help=description,
+                                   epilog=EPILOG, add_help=False,
+                                   parents=[COMMON_ARGUMENTS])
+        sp.set_defaults(func=func)
+
+        # Only the selected subcommand needs its own arguments.
+        if add_arguments is not None and name == subcmd:
+            add_arguments(sp)
 
     return parser
 
 
-def setup_logger(cmdargs: argparse.Namespace) -> None:
-    match cmdargs.verbose:
-        case 0:
-            level = logging.WARNING
-        case 1:
-            level = logging.INFO
-        case _:
-            level = logging.DEBUG
+LOG_LEVELS = {
+    0: logging.WARNING,
+    1: logging.INFO,
+}
+
 
+def setup_logger(cmdargs: argparse.Namespace) -> None:
     if cmdargs.quiet:
         level = logging.CRITICAL
+    else:
+        level = LOG_LEVELS.get(cmdargs.verbose, logging.DEBUG)
 
-    lkvm.setup_logger(logger, level=level, fmt="[%(asctime)s] %(message)s")
+    lkvm.setup_logger(logger, level=level)
 
 
 def cmd() -> int:
-    parser = setup_parser()
+    parser = setup_parser(sys.argv[1:])
     cmdargs = parser.parse_args()
 
     setup_logger(cmdargs)
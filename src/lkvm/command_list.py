@@ -13,41 +13,44 @@ logger = lkvm.logger
 
 # pylint: disable-next=unused-argument
 def main(cmdargs: argparse.Namespace) -> int:
-    basedir = os.path.expanduser("~/vm")
+    basedir = lkvm.VM_BASEDIR
 
     names  = ["NAME", "MODE", "PROFILE"]
     header = [ len(n) for n in names ]
     output = []
 
     try:
-        for ent in os.scandir(basedir):
-            if not ent.is_dir() or not os.path.isfile(os.path.join(ent.path, "config")):
-                continue
+        with os.scandir(basedir) as it:
+            for ent in it:
+                if not ent.is_dir() or not os.path.isfile(os.path.join(ent.path, "config")):
+                    continue
 
-            config = lkvm.config.read("~/vm", ent.name)
+                config = lkvm.config.read(basedir, ent.name)
 
-            if isinstance(config, lkvm.Error):
-                logger.critical("%s", config.message)
-                continue
+                if isinstance(config, lkvm.Error):
+                    logger.critical("%s", config.message)
+                    continue
 
-            if ( sz := len(ent.name)) > header[0]:
-                header[0] = sz
-            if ( sz := len(config["vm"].get("mode", "9p"))) > header[1]:
-                header[1] = sz
-            if ( sz := len(ent.path)) > header[2]:
-                header[2] = sz
+                mode = config["vm"].get("mode", "9p")
 
-            output.append([ent.name, config["vm"].get("mode", "9p"), ent.path])
+                if ( sz := len(ent.name)) > header[0]:
+                    header[0] = sz
+                if ( sz := len(mode)) > header[1]:
+                    header[1] = sz
+                if ( sz := len(ent.path)) > header[2]:
+                    header[2] = sz
+
+                output.append([ent.name, mode, ent.path])
 
     except FileNotFoundError:
         return lkvm.EX_SUCCESS
 
-    fmt = "".join([ '{:<' + str(e + 1) + '}' for e in header ])
+    widths = [ e + 1 for e in header ]
 
-    print(fmt.format(*names))
-    print("-" * (sum(header) + len(header)))
+    print("".join([ n.ljust(w) for n, w in zip(names, widths) ]))
+    print("-" * sum(widths))
 
     for e in output:
-        print(fmt.format(*e))
+        print("".join([ v.ljust(w) for v, w in zip(e, widths) ]))
 
     return lkvm.EX_SUCCESS
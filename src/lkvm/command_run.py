@@ -4,7 +4,10 @@
 import os
 import os.path
 import argparse
+import ctypes
+import signal
 import threading
+import time
 
 from typing import Optional, Dict, List, Any
 
@@ -13,32 +16,85 @@ import lkvm.config
 import lkvm.parameters
 import lkvm.qemu
 
-if lkvm.HAVE_NFS:
-    import lkvm.nfs
-
 logger = lkvm.logger
 
 sandbox_prog: Optional[str] = None
 sandbox_args: List[str] = []
 
+# From <linux/prctl.h>.
+PR_SET_PDEATHSIG = 1
+
 def arguments(config: Dict[str, Any]) -> List[str] | lkvm.Error:
     retlist: List[str] = []
 
-    for param in lkvm.parameters.PARAMS:
-        if not param.confname or not param.qemu_arg:
-            continue
-
+    for param in lkvm.parameters.ACTIVE_PARAMS:
         if args := param.qemu_arg(param.confname, config["vm"]):
-            for v in args:
-                retlist.append(lkvm.config.expandvars_string(config, v))
+            retlist.extend(args)
+
+    return lkvm.config.expandvars_values(config, retlist)
+
+
+def set_parent_death_signal(sig: int) -> bool:
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return bool(libc.prctl(PR_SET_PDEATHSIG, sig) == 0)
+    except (OSError, AttributeError):
+        return False
+
+
+def watch_parent(ppid: int) -> None:
+    while os.getppid() == ppid:
+        time.sleep(1)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def start_nfs_server(config: Dict[str, Any]) -> int:
+    import lkvm.nfs
+
+    # The server runs in its own process so that it does not compete with
+    # this one for the GIL. It is stopped by stop_nfs_server().
+    ppid = os.getpid()
+    pid = os.fork()
+
+    if pid == 0:
+        ecode = lkvm.EX_FAILURE
+        try:
+            # Ctrl-C is handled by the parent, which then stops the server.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            # Do not outlive the parent if it is killed before it can stop
+            # the server.
+            if not set_parent_death_signal(signal.SIGTERM):
+                threading.Thread(target=watch_parent, args=(ppid,), daemon=True).start()
+
+            if os.getppid() != ppid:
+                return ecode
+
+            lkvm.nfs.thread(rootfs=config["global"]["rootfs"].encode("utf-8"),
+                            mountpoints={ b"/host": b"/" },
+                            nfsport=int(config["vm"]["nfsport"]))
+            ecode = lkvm.EX_SUCCESS
+        except Exception as e:
+            logger.critical("nfs server failed: %s", e)
+        finally:
+            os._exit(ecode)
 
-    return retlist
+    logger.debug("nfs server started with pid %s", pid)
+    return pid
+
+
+def stop_nfs_server(pid: int) -> None:
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    os.waitpid(pid, 0)
 
 
 def main(cmdargs: argparse.Namespace) -> int:
     profile = cmdargs.profile
 
-    config = lkvm.config.read("~/vm", profile)
+    config = lkvm.config.read(lkvm.VM_BASEDIR, profile)
 
     if isinstance(config, lkvm.Error):
         logger.critical("%s", config.message)
@@ -59,21 +115,19 @@ def main(cmdargs: argparse.Namespace) -> int:
         logger.critical("%s", qemu_args.message)
         return lkvm.EX_FAILURE
 
+    argv = [qemu_exe] + qemu_args
+
     if cmdargs.dry_run:
         print("Command to execute:\n")
-        lkvm.qemu.dump([qemu_exe] + qemu_args)
+        lkvm.qemu.dump(argv)
         return lkvm.EX_SUCCESS
 
-    if lkvm.HAVE_NFS and config["vm"]["mode"] == "nfs":
-        t = threading.Thread(
-                target=lkvm.nfs.thread,
-                kwargs={
-                    "rootfs"      : config["global"]["rootfs"].encode("utf-8"),
-                    "mountpoints" : { b"/host": b"/" },
-                    "nfsport"     : int(config["vm"]["nfsport"]),
-                })
-        t.daemon = True
-        t.start()
+    argv[1:1] = ["-pidfile", os.path.join(config["global"]["profile"], "pid")]
+
+    nfs_pid = None
+
+    if config["vm"]["mode"] == "nfs" and lkvm.have_nfs():
+        nfs_pid = start_nfs_server(config)
 
     if sandbox_prog is not None:
         cwd = os.getcwd()
@@ -86,12 +140,13 @@ def main(cmdargs: argparse.Namespace) -> int:
                   file=fh)
             os.chmod(wrapper, 0o755)
 
-    lkvm.exec_command([
-            qemu_exe,
-            "-pidfile", os.path.join(config["global"]["profile"], "pid"),
-        ] + qemu_args)
+    try:
+        ecode = lkvm.exec_command(argv)
+    finally:
+        if nfs_pid is not None:
+            stop_nfs_server(nfs_pid)
 
     if sandbox_prog is not None:
         os.remove(wrapper)
 
-    return lkvm.EX_SUCCESS
+    return ecode
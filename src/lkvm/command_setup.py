@@ -7,7 +7,7 @@ import argparse
 import importlib.resources
 import shutil
 
-from typing import List
+from typing import Any, Dict, Iterable, TextIO
 
 import lkvm
 import lkvm.config
@@ -17,50 +17,100 @@ import lkvm.guest
 logger = lkvm.logger
 
 
+def sendfile(src: int, dst: int) -> None:
+    size = os.fstat(src).st_size
+
+    while size > 0 and (sent := os.sendfile(dst, src, None, size)):
+        size -= sent
+
+
 def copy_resource(name: str, filename: str, mode: int) -> None:
-    with importlib.resources.open_binary(lkvm.guest, name) as src:
+    resource = importlib.resources.files(lkvm.guest).joinpath(name)
+
+    with resource.open("rb") as src:
         with open(filename, "w+b") as dst:
-            shutil.copyfileobj(src, dst)
+            try:
+                sendfile(src.fileno(), dst.fileno())
+            except (AttributeError, OSError):
+                # The package is not on a real filesystem (e.g. a zip).
+                shutil.copyfileobj(src, dst)
         os.chmod(filename, mode)
 
 
+def make_directory(path: str) -> None:
+    try:
+        os.mkdir(path, mode=0o755)
+    except FileExistsError:
+        pass
+
+
 def make_symlink(src: str, dst: str) -> None:
-    if not os.path.lexists(dst):
+    try:
         os.symlink(src, dst)
+    except FileExistsError:
+        pass
 
 
-def write_file(filename: str, data: List[str]) -> None:
+def write_file(filename: str, data: Iterable[str]) -> None:
     with open(filename, "w", encoding="utf-8") as fd:
-        for line in data:
-            print(line, file=fd)
+        fd.write("".join([ f"{line}\n" for line in data ]))
+
+
+def setup_rootfs(mode: str, rootfs: str) -> None:
+    os.makedirs(rootfs, mode=0o755, exist_ok=True)
 
+    prefix = rootfs.rstrip("/") + "/"
 
-def setup_rootfs(mode: str, rootfs: str, confdata: List[str]) -> None:
-    for path in ["dev", "etc", "host", "proc", "sys", "tmp", "var/lib", "virt/home"]:
-        os.makedirs(os.path.join(rootfs, path), mode=0o755, exist_ok=True)
+    # Parents are listed before their children.
+    for path in ["dev", "etc", "host", "proc", "sys", "tmp", "var", "var/lib", "virt", "virt/home"]:
+        make_directory(prefix + path)
 
     for path in ["bin", "home", "lib", "lib64", "sbin", "usr", "etc/ld.so.conf"]:
-        make_symlink(os.path.join("/host", path), os.path.join(rootfs, path))
+        make_symlink("/host/" + path, prefix + path)
 
-    make_symlink("../proc/self/mounts", os.path.join(rootfs, "etc/mtab"))
+    make_symlink("../proc/self/mounts", prefix + "etc/mtab")
 
-    write_file(os.path.join(rootfs, "etc/passwd"), ["root:x:0:0:root:/virt/home:/bin/bash"])
-    write_file(os.path.join(rootfs, "etc/group"),  ["root:x:0:"])
+    write_file(prefix + "etc/passwd", ["root:x:0:0:root:/virt/home:/bin/bash"])
+    write_file(prefix + "etc/group",  ["root:x:0:"])
 
-    copy_resource("init.sh", os.path.join(rootfs, "virt/init"), mode=0o755)
+    copy_resource("init.sh", prefix + "virt/init", mode=0o755)
 
     if mode in ["9p"]:
-        copy_resource("init", os.path.join(rootfs, "init"), mode=0o755)
-        confdata.extend([
-            "\tvirtfs = ${rootfs}:/dev/root",
-            "\tvirtfs = /:hostfs",
-        ])
+        copy_resource("init", prefix + "init", mode=0o755)
+
+
+def render_config(fh: TextIO, vmconfig: Dict[str, Any], mode: str) -> None:
+    actions = lkvm.parameters.CONFACTIONS
+
+    fh.write("[vm]\n")
+
+    for k, v in vmconfig.items():
+        if actions.get(k) == "append":
+            for e in v:
+                fh.write(f"\t{k} = {e}\n")
+        elif v and isinstance(v, (bool, str)):
+            # Numeric defaults (smp) are detected at run time, not saved.
+            fh.write(f"\t{k} = {v}\n")
+
+    if mode == "9p":
+        fh.write("\tvirtfs = ${rootfs}:/dev/root\n")
+        fh.write("\tvirtfs = /:hostfs\n")
+        fh.write("\t# kernel = /path/to/linux/bzImage\n")
+
+    if mode == "nfs":
+        fh.write("\tdevice = e1000,netdev=nfs0\n")
+        fh.write("\tnetwork = netdev,user,id=nfs0\n")
+        fh.write("\t# nfsport = 2049\n")
+        fh.write("\t# kernel = /path/to/linux/bzImage\n")
+
+    if mode == "disk":
+        fh.write("\t# disk = /path/to/disk.qcow2\n")
 
 
 def main(cmdargs: argparse.Namespace) -> int:
     profile = cmdargs.profile
 
-    config = lkvm.config.read("~/vm", profile)
+    config = lkvm.config.read(lkvm.VM_BASEDIR, profile)
 
     if isinstance(config, lkvm.Error):
         logger.critical("%s", config.message)
@@ -81,37 +131,17 @@ def main(cmdargs: argparse.Namespace) -> int:
         config["vm"]["machine"]    = "accel=tcg"
         config["vm"]["enable-kvm"] = False
 
-    data = [
-        "[vm]",
-    ]
+    if cmdargs.mode == "nfs" and not lkvm.have_nfs():
+        logger.critical("nfs mode is not available because the required python modules are missing.")
+        return lkvm.EX_FAILURE
 
-    for k, v in config["vm"].items():
-        if isinstance(v, list):
-            for e in v:
-                data.append(f"\t{k} = {e}")
-        elif isinstance(v, (bool, str)):
-            if v:
-                data.append(f"\t{k} = {v}")
-
-    if cmdargs.mode == "nfs":
-        if not lkvm.HAVE_NFS:
-            logger.critical("nfs mode is not available because the required python modules are missing.")
-            return lkvm.EX_FAILURE
-        setup_rootfs(cmdargs.mode, config["global"]["rootfs"], data)
-        data.append("\tdevice = e1000,netdev=nfs0")
-        data.append("\tnetwork = netdev,user,id=nfs0")
-        data.append("\t# nfsport = 2049")
-        data.append("\t# kernel = /path/to/linux/bzImage")
-
-    if cmdargs.mode == "9p":
-        setup_rootfs(cmdargs.mode, config["global"]["rootfs"], data)
-        data.append("\t# kernel = /path/to/linux/bzImage")
-
-    if cmdargs.mode == "disk":
-        data.append("\t# disk = /path/to/disk.qcow2")
+    if cmdargs.mode in ["9p", "nfs"]:
+        setup_rootfs(cmdargs.mode, config["global"]["rootfs"])
 
     os.makedirs(config["global"]["profile"], mode=0o755, exist_ok=True)
-    write_file(config["global"]["config"], data)
+
+    with open(config["global"]["config"], "w", encoding="utf-8") as fh:
+        render_config(fh, config["vm"], cmdargs.mode)
 
     if cmdargs.mode in ["9p", "nfs"]:
         logger.warning("for %s mode it is necessary to specify a kernel to run.", cmdargs.mode)
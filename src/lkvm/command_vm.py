@@ -7,7 +7,7 @@ import os.path
 import socket
 import json
 
-from typing import Dict, List, Any
+from typing import BinaryIO, Dict, Any
 
 import lkvm
 import lkvm.config
@@ -15,26 +15,37 @@ import lkvm.qemu
 
 logger = lkvm.logger
 
+QMP_REPLY_KEYS = ("QMP", "return", "error")
 
-def qmp_send(sock: socket.socket, message: str) -> Dict[str, Any]:
-    if message:
-        logger.debug(">>> %s", message)
-        sock.sendall(message.encode())
-
-    res = {}
+QMP_TIMEOUT = 5.0
 
-    while 'QMP' not in res and 'return' not in res and 'error' not in res:
-        data: List[bytes] = []
 
-        while data[-2:] != [b'\r', b'\n']:
-            data.append(sock.recv(1))
+def qmp_send(sock: socket.socket, reader: BinaryIO, message: str) -> Dict[str, Any]:
+    if message:
+        logger.debug(">>> %s", message)
+        try:
+            sock.sendall(message.encode())
+        except OSError as e:
+            logger.critical("qmp: unable to send command: %s", e)
+            return {}
+
+    while True:
+        # QMP sends one JSON object per line.
+        try:
+            line = reader.readline()
+        except TimeoutError:
+            logger.critical("qmp: timed out waiting for reply.")
+            return {}
+
+        if not line:
+            return {}
+
+        res: Dict[str, Any] = json.loads(line)
+        logger.debug("<<< %s", res)
 
-        if not data:
+        if any(k in res for k in QMP_REPLY_KEYS):
             break
 
-        res = json.loads(b''.join(data))
-        logger.debug("<<< %s", res)
-
     if 'error' in res:
         if 'desc' in res['error']:
             logger.critical(res['error']['desc'])
@@ -47,7 +58,7 @@ def qmp_send(sock: socket.socket, message: str) -> Dict[str, Any]:
 def main(cmdargs: argparse.Namespace) -> int:
     profile = cmdargs.profile
 
-    config = lkvm.config.read("~/vm", profile)
+    config = lkvm.config.read(lkvm.VM_BASEDIR, profile)
 
     if isinstance(config, lkvm.Error):
         logger.critical("%s", config.message)
@@ -61,27 +72,36 @@ def main(cmdargs: argparse.Namespace) -> int:
 
     try:
         sock = None
+        reader = None
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+        sock.settimeout(QMP_TIMEOUT)
+
+        try:
+            sock.connect(qmp_socket)
+        except OSError as e:
+            logger.critical("qmp: unable to connect to %s: %s", qmp_socket, e)
+            return lkvm.EX_FAILURE
 
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.connect(qmp_socket)
+        reader = sock.makefile("rb")
 
         #
         # https://www.qemu.org/docs/master/interop/qemu-qmp-ref.html
         #
-        if not qmp_send(sock, '') or \
-           not qmp_send(sock, '{"execute":"qmp_capabilities"}'):
+        if not qmp_send(sock, reader, '') or \
+           not qmp_send(sock, reader, '{"execute":"qmp_capabilities"}'):
             return lkvm.EX_FAILURE
 
         if cmdargs.vm_state == "quit":
-            if not qmp_send(sock, '{"execute":"quit"}'):
+            if not qmp_send(sock, reader, '{"execute":"quit"}'):
                 return lkvm.EX_FAILURE
 
         elif cmdargs.vm_state == "stop":
-            if not qmp_send(sock, '{"execute":"stop"}'):
+            if not qmp_send(sock, reader, '{"execute":"stop"}'):
                 return lkvm.EX_FAILURE
 
         elif cmdargs.vm_state == "continue":
-            if not qmp_send(sock, '{"execute":"cont"}'):
+            if not qmp_send(sock, reader, '{"execute":"cont"}'):
                 return lkvm.EX_FAILURE
 
         if cmdargs.dump_memory:
@@ -92,9 +112,14 @@ def main(cmdargs: argparse.Namespace) -> int:
                     "protocol": f"file:{cmdargs.dump_memory}",
                 },
             }
-            if not qmp_send(sock, json.dumps(cmd)):
+            # Dumping a large guest can take any amount of time and QEMU
+            # replies only once the dump is complete.
+            sock.settimeout(None)
+            if not qmp_send(sock, reader, json.dumps(cmd)):
                 return lkvm.EX_FAILURE
     finally:
+        if reader is not None:
+            reader.close()
         if sock is not None:
             sock.close()
 
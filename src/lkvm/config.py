@@ -1,71 +1,88 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 # Copyright (C) 2024  Alexey Gladkov <legion@kernel.org>
 
+import os
 import os.path
 import re
 
 from typing import Dict, List, Tuple, Any
-from collections.abc import Generator
 
 import lkvm
 import lkvm.parameters
 
 logger = lkvm.logger
 
+RE_VARIABLE = re.compile(r"\$\{(?P<name>[A-Za-z0-9_.-]+)\}")
+RE_SECTION  = re.compile(r"^\s*\[(?P<name>\S+)(\s+[\"'](?P<subname>[^\"']+)[\"'])?\]\s*$")
+RE_KEYVALUE = re.compile(r"^\s*(?P<name>[A-Za-z0-9_.-]+)\s*=\s*(?P<value>.*)\s*$")
+
+SUBST_MAX_PASSES = 8
+
 
 class Mapping:
     def __init__(self, arg: Dict[str, Any]):
         self.arg = arg
 
-    def __walk(self, d: Dict[str, Any], p: List[str]) -> Generator[Tuple[str, Any], None, None]:
-        for k, v in d.items():
-            n = p + [k]
-            if isinstance(v, dict):
-                yield from self.__walk(v, n)
-            yield ".".join(n), v
+    def variables(self) -> Dict[str, Any]:
+        ret: Dict[str, Any] = {}
+        stack: List[Tuple[str, Dict[str, Any]]] = [("", self.arg)]
+
+        while stack:
+            prefix, d = stack.pop()
+
+            for k, v in d.items():
+                name = f"{prefix}{k}"
+                if isinstance(v, dict):
+                    stack.append((f"{name}.", v))
+                # Global values are referenced without the prefix.
+                if name.startswith("global."):
+                    name = name[len("global."):]
+                ret[name] = v
 
-    def walk(self) -> Generator[Tuple[str, Any], None, None]:
-        return self.__walk(self.arg, [])
+        return ret
 
 
 # pylint: disable-next=unused-argument
-def subst_str(mapping: Mapping, key: List[str], value: str) -> str:
-    varlist: List[str] = []
+def subst_str(variables: Dict[str, Any], key: List[str], value: str) -> str:
+    if "${" not in value:
+        return value
 
-    while True:
-        newlist = re.findall(r'\$\{(?P<name>[A-Za-z0-9_.-]+)\}', value)
+    def replace(m: re.Match[str]) -> str:
+        name = m.group("name")
+        if name in variables:
+            return str(variables[name])
+        return m.group(0)
 
-        if newlist == varlist:
-            break
+    # A substituted value may refer to other variables. Limit the number of
+    # passes so that self-referencing variables cannot loop forever.
+    for _ in range(SUBST_MAX_PASSES):
+        newvalue = RE_VARIABLE.sub(replace, value)
 
-        varlist = newlist
+        if newvalue == value:
+            break
 
-        for k, v in mapping.walk():
-            if k.startswith("global."):
-                k = k[len("global."):]
-            if k in varlist:
-                value = re.sub(re.escape(f"${{{k}}}"), str(v), value)
+        value = newvalue
 
     return value
 
 
-def subst(mapping: Mapping, key: List[str], value: Any) -> Any:
+def subst(variables: Dict[str, Any], key: List[str], value: Any) -> Any:
     if isinstance(value, str):
-        return subst_str(mapping, key, value)
+        return subst_str(variables, key, value)
 
     if isinstance(value, dict):
         for k, v in value.items():
-            value[k] = subst(mapping, key + [k], v)
+            value[k] = subst(variables, key + [k], v)
         return value
 
     if isinstance(value, list):
-        return list(map(lambda x: subst(mapping, key, x), value))
+        return list(map(lambda x: subst(variables, key, x), value))
 
     return value
 
 
 def expandvars(config: Dict[str,Any]) -> Dict[str,Any] | lkvm.Error:
-    ret = subst(Mapping(config), [], config)
+    ret = subst(Mapping(config).variables(), [], config)
 
     if not isinstance(ret, dict):
         return lkvm.Error("unable to parse config file")
@@ -74,15 +91,16 @@ def expandvars(config: Dict[str,Any]) -> Dict[str,Any] | lkvm.Error:
 
 
 def expandvars_string(config: Dict[str,Any], value: str) -> str:
-    return subst_str(Mapping(config), [], value)
+    return subst_str(Mapping(config).variables(), [], value)
 
 
-def add_value(config: Dict[str, Any], name: str, value: Any) -> None:
-    conf_type = "store"
+def expandvars_values(config: Dict[str,Any], values: List[str]) -> List[str]:
+    variables = Mapping(config).variables()
+    return [ subst_str(variables, [], v) for v in values ]
+
 
-    if name in lkvm.parameters.CONFNAMES:
-        i = lkvm.parameters.CONFNAMES.index(name)
-        conf_type = lkvm.parameters.PARAMS[i].action
+def add_value(config: Dict[str, Any], name: str, value: Any) -> None:
+    conf_type = lkvm.parameters.CONFACTIONS.get(name, "store")
 
     if conf_type in ["append"]:
         if name not in config:
@@ -114,10 +132,7 @@ def read(basedir: str, name: str) -> Dict[str, Any] | lkvm.Error:
             "config" : conffile,
             "rootfs" : rootfs,
         },
-        "env": {
-            "home": os.getenv("HOME"),
-            "user": os.getenv("USER"),
-        },
+        "env": dict(lkvm.ENV),
         section: {},
     }
 
@@ -125,21 +140,24 @@ def read(basedir: str, name: str) -> Dict[str, Any] | lkvm.Error:
         return config
 
     with open(conffile, "r", encoding="utf-8") as f:
-        while line := f.readline():
+        for line in f:
             line = line.rstrip()
 
             if not line:
                 continue
 
-            if m := re.match(r"^\s*#.*", line):
-                continue
+            stripped = line.lstrip()
 
-            if m := re.match(r"^\s*\[(?P<name>\S+)(\s+[\"'](?P<subname>[^\"']+)[\"'])?\]\s*$", line):
-                #section    = m.group("name")
-                #subsection = m.group("subname") or ""
+            if stripped.startswith("#"):
                 continue
 
-            if m := re.match(r"^\s*(?P<name>[A-Za-z0-9_.-]+)\s*=\s*(?P<value>.*)\s*$", line):
+            if stripped.startswith("["):
+                if m := RE_SECTION.match(line):
+                    #section    = m.group("name")
+                    #subsection = m.group("subname") or ""
+                    continue
+
+            elif m := RE_KEYVALUE.match(line):
                 if section not in config:
                     config[section] = {}
 
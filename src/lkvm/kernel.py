@@ -5,7 +5,7 @@ import os
 import os.path
 import glob
 
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Tuple, Any
 from collections.abc import Mapping
 
 import lkvm
@@ -13,6 +13,14 @@ import lkvm
 logger = lkvm.logger
 
 
+def image_mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        # The image was removed while searching.
+        return -1.0
+
+
 def find_image(srctree: str, env: Optional[Mapping[str,str]]=None) -> Optional[str]:
     if env is not None:
         for envname in ["KBUILD_OUTPUT", "KBUILD_ABS_SRCTREE"]:
@@ -22,30 +30,27 @@ def find_image(srctree: str, env: Optional[Mapping[str,str]]=None) -> Optional[s
                 srctree = value
                 break
 
-    res = []
+    image = max(glob.glob(f"{srctree}/arch/*/boot/*Image"), key=image_mtime, default=None)
 
-    for img in glob.glob(f'{srctree}/arch/*/boot/*Image'):
-        statinfo = os.stat(img)
-        res.append((statinfo.st_mtime, img))
-
-    if len(res) == 0:
+    if image is None:
         return None
 
-    sorted(res, key=lambda x: x[0], reverse=True)
-
-    logger.debug("Found kernel image: %s", res[0][1])
-    return os.path.realpath(res[0][1])
+    logger.debug("Found kernel image: %s", image)
+    return os.path.realpath(image)
 
 
 class KernelCmdline:
+    MODE_KEYS = frozenset(["rw", "ro"])
+
     def __init__(self, init: Dict[str, Any]):
         self._mode = "ro"
-        self._dict: Dict[str,str] = {}
+        self._dict: Dict[str,Any] = {}
+        self._cache: Optional[str] = None
         for k, v in init.items():
             self[k] = v
 
     def __contains__(self, key: str) -> bool:
-        if key in ["rw", "ro"]:
+        if key in self.MODE_KEYS:
             return self._mode == key
         return key in self._dict
 
@@ -53,7 +58,8 @@ class KernelCmdline:
         return self._dict[key]
 
     def __setitem__(self, key: str, value: Any) -> None:
-        if key in ["rw", "ro"]:
+        self._cache = None
+        if key in self.MODE_KEYS:
             self._mode = key
             return
         self._dict[key] = value
@@ -69,7 +75,13 @@ class KernelCmdline:
     def keys(self) -> List[str]:
         return list(self._dict.keys())
 
+    def items(self) -> List[Tuple[str, Any]]:
+        return list(self._dict.items())
+
     def join(self) -> str:
+        if self._cache is not None:
+            return self._cache
+
         ret = [ self._mode ]
         for k in sorted(self._dict.keys()):
             if self._dict[k] is None:
@@ -78,7 +90,9 @@ class KernelCmdline:
                 ret.append(k)
             else:
                 ret.append(f"{k}={self._dict[k]}")
-        return " ".join(ret)
+
+        self._cache = " ".join(ret)
+        return self._cache
 
 
 CMDLINE = KernelCmdline({})
@@ -5,7 +5,8 @@ import abc
 import asyncio
 import datetime
 import errno
-import hmac
+import hashlib
+import operator
 import os
 import os.path
 import secrets
@@ -14,6 +15,7 @@ import struct
 import time
 import weakref
 
+from collections import OrderedDict
 from typing import Optional, Sequence, Dict, Tuple, Union, Any
 
 from shenaniganfs.fs          import FileType, BaseFSEntry, BaseFS, NFSError, FSException, DecodedFileHandle # type: ignore[import-untyped]
@@ -47,10 +49,75 @@ ERRNO_MAPPING = {
     errno.ESTALE       : NFSError.ERR_STALE,
 }
 
+ERRNO_TABLE = tuple(ERRNO_MAPPING.get(n, NFSError.ERR_IO) for n in range(max(ERRNO_MAPPING) + 1))
+
+# Number of read-only file descriptors kept open.
+FD_CACHE_SIZE = 256
+
+# The NFS service reads at most 4k per call. Sequential reads are served from
+# a larger buffer kept for the most recently read files.
+READAHEAD_SIZE = 65536
+READAHEAD_FILES = 32
+
+# Number of directories whose listing is kept.
+LISTING_CACHE_SIZE = 1024
+
+# Timestamp granularity assumed for the host filesystem. A change made within
+# this long of the last one may leave mtime unchanged, so anything read that
+# close to it cannot be validated by mtime (git's racy-index rule).
+RACY_TIMESTAMP_NS = 1_000_000_000
+
+# Parent directories are opened with these flags, by path on every call: a
+# cached descriptor would keep pointing at a directory the host has since
+# replaced or moved.
+DIRFD_FLAGS = os.O_DIRECTORY|os.O_NOFOLLOW|os.O_NOCTTY
+
+# Number of encoded file handles remembered by the handle encoder.
+FH_CACHE_SIZE = 4096
+
+# File handle payload: FileID and FSID.
+FH_STRUCT = struct.Struct("!QQ")
+
+FILETYPE_MAPPING = {
+    stat.S_IFDIR  : FileType.DIR,
+    stat.S_IFCHR  : FileType.CHR,
+    stat.S_IFBLK  : FileType.BLK,
+    stat.S_IFREG  : FileType.REG,
+    stat.S_IFIFO  : FileType.FIFO,
+    stat.S_IFLNK  : FileType.LNK,
+    stat.S_IFSOCK : FileType.SOCK,
+}
+
 
 class FSEntry(BaseFSEntry): # type: ignore
+    __slots__ = ("fs_source", "fs_stat", "fs_links", "fs_childs", "fs_childs_stamp",
+                 "fs_childs_seq", "fs_dot", "fs_dotdot",
+                 "fs", "type", "name", "parent_id", "fileid", "nlink",
+                 "mode", "size", "blocks", "uid", "gid", "rdev")
+
     fs_source: bytes
     fs_stat: os.stat_result
+    fs_links: int
+    # Directory listing, the directory (mtime, inode) it was read at and
+    # the time it was read.
+    fs_childs: Optional[Dict[bytes, "FSEntry"]]
+    fs_childs_stamp: Tuple[int, int, int]
+    fs_childs_seq: Tuple["FSEntry", ...]
+    fs_dot: Optional["FSEntryLink"]
+    fs_dotdot: Optional["FSEntryLink"]
+
+    # Timestamps are only needed when attributes are sent to the client.
+    @property
+    def atime(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.fs_stat.st_atime, datetime.UTC)
+
+    @property
+    def mtime(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.fs_stat.st_mtime, datetime.UTC)
+
+    @property
+    def ctime(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.fs_stat.st_ctime, datetime.UTC)
 
 
 class FSEntryLink(FSEntry):
@@ -60,50 +127,60 @@ class FSEntryLink(FSEntry):
         self.base = base
         self.replacements = replacements
 
+        for k, v in replacements.items():
+            setattr(self, k, v)
+
     def __getattr__(self, item: str) -> Any:
         if item in self.replacements:
             return self.replacements[item]
         return getattr(self.base, item)
 
 
+# Reading an empty slot of a link raises AttributeError before __getattr__ is
+# tried, which is slow. The fields are forwarded to the base entry directly.
+for _slot in FSEntry.__slots__:
+    if _slot != "name":
+        setattr(FSEntryLink, _slot, property(operator.attrgetter(f"base.{_slot}")))
+
+
 class FSinodes(abc.ABC):
     def __init__(self) -> None:
-        self.inodes: Dict[Tuple[int,int],int] = {}
+        self.inodes: Dict[int,int] = {}
         self.last_inode = 0
 
     def get(self, dev: int, ino: int) -> int:
-        v = (dev, ino)
-        if v not in self.inodes:
+        # Both st_dev and st_ino fit in 64 bits.
+        v = (dev << 64) | ino
+        r = self.inodes.get(v)
+        if r is None:
             self.last_inode += 1
-            self.inodes[v] = self.last_inode
-        return self.inodes[v]
+            r = self.last_inode
+            self.inodes[v] = r
+        return r
 
     def put(self, dev: int, ino: int) -> None:
-        v = (dev, ino)
+        v = (dev << 64) | ino
         del self.inodes[v]
 
 
 def nfserror_from_errno(errnum: int) -> Any:
-    return ERRNO_MAPPING.get(errnum, NFSError.ERR_IO)
+    if errnum is not None and 0 <= errnum < len(ERRNO_TABLE):
+        return ERRNO_TABLE[errnum]
+    return NFSError.ERR_IO
 
 def fill_fsentry(entry: FSEntry, st: os.stat_result) -> FSEntry:
-    kwargs: Dict[str, Any] = {
-            "fs_stat" : st,
-            "mode"    : st.st_mode,
-            "size"    : st.st_size,
-            "blocks"  : st.st_blocks,
-            "uid"     : st.st_uid,
-            "gid"     : st.st_gid,
-            "rdev"    : (os.major(st.st_rdev), os.minor(st.st_rdev)) if st.st_rdev else (0, 0),
-            "atime"   : datetime.datetime.fromtimestamp(st.st_atime, datetime.UTC),
-            "mtime"   : datetime.datetime.fromtimestamp(st.st_mtime, datetime.UTC),
-            "ctime"   : datetime.datetime.fromtimestamp(st.st_ctime, datetime.UTC),
-    }
-
-    for k, v in kwargs.items():
-        setattr(entry, k, v)
+    entry.fs_stat = st
+    entry.mode    = st.st_mode
+    entry.size    = st.st_size
+    entry.blocks  = st.st_blocks
+    entry.uid     = st.st_uid
+    entry.gid     = st.st_gid
+    entry.rdev    = (os.major(st.st_rdev), os.minor(st.st_rdev)) if st.st_rdev else (0, 0)
     return entry
 
+def is_racy(stamp_ns: int, read_ns: int) -> bool:
+    return read_ns - stamp_ns < RACY_TIMESTAMP_NS
+
 def close_no_exc(fd: int) -> None:
     try:
         if fd >= 0:
@@ -120,16 +197,32 @@ def set_fd_attrs(fd: int, attrs: Dict[str, Any]) -> None:
     if "mode" in attrs:
         os.fchmod(fd, attrs["mode"])
 
-    if "atime" in attrs or "mtime" in attrs:
-        atime = mtime = int(time.time())
+    if times := attrs_times(attrs):
+        os.utime(fd, times=times)
 
-        if "atime" in attrs and attrs["atime"] is not None:
-            atime = int(attrs["atime"].timestamp())
+def set_link_attrs(name: bytes, dir_fd: int, attrs: Dict[str, Any]) -> None:
+    # A symlink cannot be opened, and Linux ignores its mode.
+    if "uid" in attrs or "gid" in attrs:
+        uid = attrs.get("uid", -1)
+        gid = attrs.get("gid", -1)
+        os.chown(name, uid, gid, dir_fd=dir_fd, follow_symlinks=False)
 
-        if "mtime" in attrs and attrs["mtime"] is not None:
-            mtime = int(attrs["mtime"].timestamp())
+    if times := attrs_times(attrs):
+        os.utime(name, times=times, dir_fd=dir_fd, follow_symlinks=False)
 
-        os.utime(fd, times=(atime, mtime))
+def attrs_times(attrs: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    if "atime" not in attrs and "mtime" not in attrs:
+        return None
+
+    atime = mtime = int(time.time())
+
+    if "atime" in attrs and attrs["atime"] is not None:
+        atime = int(attrs["atime"].timestamp())
+
+    if "mtime" in attrs and attrs["mtime"] is not None:
+        mtime = int(attrs["mtime"].timestamp())
+
+    return (atime, mtime)
 
 
 class OverlayFS(BaseFS): # type: ignore
@@ -153,6 +246,10 @@ class OverlayFS(BaseFS): # type: ignore
         self.mountpoints = mountpoints or {}
         self.entries: Dict[int, FSEntry] = {}
         self.inodes = FSinodes()
+        self.fsref = weakref.ref(self)
+        self.fds: OrderedDict[Tuple[int, int], int] = OrderedDict()
+        self.listings: OrderedDict[int, FSEntry] = OrderedDict()
+        self.readahead: OrderedDict[int, Tuple[Tuple[int, int, int], int, bytes]] = OrderedDict()
 
         self.root_dir = None
         self.root_dir = self.create_fsentry(rootfs, b"")
@@ -161,17 +258,11 @@ class OverlayFS(BaseFS): # type: ignore
     def create_fsentry(self, base: bytes, name: bytes,
                        parent: Optional[FSEntry] = None,
                        fstat: Optional[os.stat_result] = None) -> FSEntry:
-        types = {
-            stat.S_IFDIR : FileType.DIR,
-            stat.S_IFCHR : FileType.CHR,
-            stat.S_IFBLK : FileType.BLK,
-            stat.S_IFREG : FileType.REG,
-            stat.S_IFIFO : FileType.FIFO,
-            stat.S_IFLNK : FileType.LNK,
-            stat.S_IFSOCK: FileType.SOCK,
-        }
-
-        path = os.path.abspath(os.path.join(base, name))
+        if parent is not None and name:
+            # The parent's path is already absolute and normalized.
+            path = base + name if base.endswith(b"/") else base + b"/" + name
+        else:
+            path = os.path.abspath(os.path.join(base, name))
 
         if self.root_dir and path.startswith(self.root_dir.fs_source):
             if redirect := self.mountpoints.get(path[len(self.root_dir.fs_source):]):
@@ -182,23 +273,73 @@ class OverlayFS(BaseFS): # type: ignore
 
         entry = fill_fsentry(FSEntry(), fstat)
 
-        kwargs: Dict[str, Any] = {
-                "fs_source" : path,
-                "fs_links"  : 0,
-                "fs"        : weakref.ref(self),
-                "type"      : types.get(stat.S_IFMT(entry.fs_stat.st_mode),
-                                        FileType.REG),
-                "name"      : name,
-                "parent_id" : parent.fileid if parent else None,
-                "fileid"    : self.inodes.get(entry.fs_stat.st_dev,
-                                              entry.fs_stat.st_ino),
-                "nlink"     : 2,
-        }
-
-        for k, v in kwargs.items():
-            setattr(entry, k, v)
+        # The BaseFSEntry fields are only declared by shenaniganfs.
+        # pylint: disable=attribute-defined-outside-init
+        entry.fs_source          = path
+        entry.fs_links           = 0
+        entry.fs_childs          = None
+        entry.fs_childs_stamp    = (-1, -1, -1)
+        entry.fs_childs_seq      = ()
+        entry.fs_dot             = None
+        entry.fs_dotdot          = None
+        entry.fs                 = self.fsref
+        entry.type               = FILETYPE_MAPPING.get(stat.S_IFMT(fstat.st_mode), FileType.REG)
+        entry.name               = name
+        entry.parent_id          = parent.fileid if parent else None
+        entry.fileid             = self.inodes.get(fstat.st_dev, fstat.st_ino)
+        entry.nlink              = 2
         return entry
 
+    def open_fd(self, entry: FSEntry, flags: int) -> int:
+        key = (entry.fileid, flags)
+
+        if (fd := self.fds.get(key)) is not None:
+            self.fds.move_to_end(key)
+            return fd
+
+        fd = os.open(entry.fs_source, flags)
+        self.fds[key] = fd
+
+        if len(self.fds) > FD_CACHE_SIZE:
+            _, old = self.fds.popitem(last=False)
+            close_no_exc(old)
+
+        return fd
+
+    def close_fds(self, entry: FSEntry) -> None:
+        for key in [ k for k in self.fds if k[0] == entry.fileid ]:
+            close_no_exc(self.fds.pop(key))
+        self.readahead.pop(entry.fileid, None)
+
+    def read_ahead(self, entry: FSEntry, fd: int, st: os.stat_result, offset: int, count: int) -> bytes:
+        # The buffer is only valid while the file is unchanged.
+        stamp = (st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+
+        if (ra := self.readahead.get(entry.fileid)) is not None:
+            ra_stamp, ra_offset, ra_data = ra
+            start = offset - ra_offset
+
+            if ra_stamp == stamp and 0 <= start and \
+               (start + count <= len(ra_data) or ra_offset + len(ra_data) >= st.st_size):
+                self.readahead.move_to_end(entry.fileid)
+                return ra_data[start:start + count]
+
+        read_ns = time.time_ns()
+        data = os.pread(fd, max(count, READAHEAD_SIZE), offset)
+
+        # A same-size overwrite in the same tick as the last change would
+        # keep the stamp, so such a buffer is not kept.
+        if len(data) > count and not is_racy(max(st.st_mtime_ns, st.st_ctime_ns), read_ns):
+            self.readahead[entry.fileid] = (stamp, offset, data)
+            self.readahead.move_to_end(entry.fileid)
+
+            if len(self.readahead) > READAHEAD_FILES:
+                self.readahead.popitem(last=False)
+        else:
+            self.readahead.pop(entry.fileid, None)
+
+        return data[:count]
+
     def track_entry(self, entry: FSEntry) -> None:
         if entry.fileid not in self.entries:
             logger.debug("add entry: inode=%s: %s", entry.fileid, entry.fs_source)
@@ -217,6 +358,8 @@ class OverlayFS(BaseFS): # type: ignore
 
         logger.debug("put entry: inode=%s: %s", entry.fileid, entry.fs_source)
 
+        self.close_fds(entry)
+
         self.inodes.put(entry.fs_stat.st_dev, entry.fs_stat.st_ino)
         del self.entries[entry.fileid]
 
@@ -230,38 +373,66 @@ class OverlayFS(BaseFS): # type: ignore
     def get_entry_by_id(self, fileid: int) -> Optional[FSEntry]:
         return self.entries.get(fileid)
 
+    def drop_dir_childs(self, directory: Optional[FSEntry]) -> None:
+        if directory is not None:
+            directory.fs_childs = None
+            directory.fs_childs_seq = ()
+            self.listings.pop(directory.fileid, None)
+
     def get_dir_childs(self, directory: FSEntry) -> Dict[bytes, FSEntry]:
         self._verify_owned(directory)
 
         if directory.type != FileType.DIR:
             raise FSException(NFSError.ERR_NOTDIR)
 
-        parent = directory.fs().root_dir
-
-        if directory.parent_id:
-            parent = self.get_entry_by_id(directory.parent_id)
-
-        childs: Dict[bytes, FSEntry] = {
-                b"." : FSEntryLink(directory, {"name": b"." }),
-                b"..": FSEntryLink(parent,    {"name": b".."}),
-        }
-
         try:
             fd = -1
             fd = os.open(directory.fs_source, os.O_DIRECTORY|os.O_NOFOLLOW|os.O_NOCTTY)
 
-            for name in os.listdir(fd):
-                fname = name.encode("utf-8")
-                st = os.lstat(fname, dir_fd=fd)
+            read_ns = time.time_ns()
+
+            # The directory has not changed or been replaced since it was
+            # last read. A listing read in the same tick as the last change
+            # could miss a later change that leaves mtime as it is.
+            dirst = os.fstat(fd)
+            stamp = (dirst.st_mtime_ns, dirst.st_ino, read_ns)
+            cached = directory.fs_childs_stamp
+
+            if directory.fs_childs is not None and cached[:2] == stamp[:2] and \
+               not is_racy(cached[0], cached[2]):
+                if directory.fileid in self.listings:
+                    self.listings.move_to_end(directory.fileid)
+                return directory.fs_childs
+
+            parent = directory.fs().root_dir
+
+            if directory.parent_id:
+                parent = self.get_entry_by_id(directory.parent_id)
+
+            if directory.fs_dot is None:
+                directory.fs_dot = FSEntryLink(directory, {"name": b"." })
+
+            if directory.fs_dotdot is None or directory.fs_dotdot.base is not parent:
+                directory.fs_dotdot = FSEntryLink(parent, {"name": b".."})
+
+            childs: Dict[bytes, FSEntry] = {
+                    b"." : directory.fs_dot,
+                    b"..": directory.fs_dotdot,
+            }
+
+            with os.scandir(fd) as it:
+                for ent in it:
+                    fname = os.fsencode(ent.name)
+                    st = ent.stat(follow_symlinks=False)
 
-                if cur := self.get_entry_by_id(self.inodes.get(st.st_dev, st.st_ino)):
-                    childs[fname] = cur
-                    continue
+                    if cur := self.get_entry_by_id(self.inodes.get(st.st_dev, st.st_ino)):
+                        childs[fname] = cur
+                        continue
 
-                new = self.create_fsentry(directory.fs_source, fname,
-                                          parent=directory, fstat=st)
-                childs[fname] = new
-                self.track_entry(new)
+                    new = self.create_fsentry(directory.fs_source, fname,
+                                              parent=directory, fstat=st)
+                    childs[fname] = new
+                    self.track_entry(new)
 
         except OSError as exc:
             raise FSException(nfserror_from_errno(exc.errno), exc.strerror) from exc
@@ -269,6 +440,17 @@ class OverlayFS(BaseFS): # type: ignore
             close_no_exc(fd)
 
         directory.nlink = len(childs)
+        directory.fs_childs = childs
+        directory.fs_childs_stamp = stamp
+        directory.fs_childs_seq = tuple(childs.values())
+
+        # Entries stay tracked; only the oldest listing is forgotten.
+        self.listings[directory.fileid] = directory
+        self.listings.move_to_end(directory.fileid)
+
+        if len(self.listings) > LISTING_CACHE_SIZE:
+            _, old = self.listings.popitem(last=False)
+            self.drop_dir_childs(old)
 
         return childs
 
@@ -283,8 +465,8 @@ class OverlayFS(BaseFS): # type: ignore
     def readdir(self, directory: FSEntry) -> Sequence[FSEntry]:
         logger.debug("CALL: readdir: dir=%s", directory.fs_source)
 
-        childs = self.get_dir_childs(directory)
-        return list(childs.values())
+        self.get_dir_childs(directory)
+        return directory.fs_childs_seq
 
     def mkdir(self, dest: FSEntry, name: bytes, attrs: Dict[str, Any]) -> FSEntry:
         logger.debug("CALL: mkdir: dir=%s name=%s", dest.fs_source, name)
@@ -295,11 +477,11 @@ class OverlayFS(BaseFS): # type: ignore
 
         try:
             fd1 = -1
-            fd1 = os.open(dest.fs_source, os.O_DIRECTORY|os.O_NOFOLLOW|os.O_NOCTTY)
+            fd2 = -1
+            fd1 = os.open(dest.fs_source, DIRFD_FLAGS)
 
             os.mkdir(name, mode=0o700, dir_fd=fd1)
 
-            fd2 = -1
             fd2 = os.open(name, os.O_DIRECTORY|os.O_NOFOLLOW|os.O_NOCTTY, dir_fd=fd1)
 
             set_fd_attrs(fd2, attrs)
@@ -314,6 +496,8 @@ class OverlayFS(BaseFS): # type: ignore
             close_no_exc(fd1)
             close_no_exc(fd2)
 
+        self.drop_dir_childs(dest)
+
         entry = self.create_fsentry(dest.fs_source, name, parent=dest, fstat=st)
         self.track_entry(entry)
 
@@ -340,6 +524,8 @@ class OverlayFS(BaseFS): # type: ignore
             logger.critical("Unexpected exception in rmdir(): %s", repr(exc))
             raise FSException(NFSError.ERR_IO) from exc
 
+        self.drop_dir_childs(self.get_entry_by_id(entry.parent_id))
+        self.close_fds(entry)
         self.remove_entry(entry)
 
     def rename(self, source: FSEntry, to_dir: FSEntry, new_name: bytes) -> None:
@@ -355,7 +541,7 @@ class OverlayFS(BaseFS): # type: ignore
 
         try:
             fd1 = -1
-            fd1 = os.open(to_dir.fs_source, os.O_DIRECTORY|os.O_NOFOLLOW|os.O_NOCTTY)
+            fd1 = os.open(to_dir.fs_source, DIRFD_FLAGS)
 
             os.rename(source.fs_source, new_name, dst_dir_fd=fd1)
             st = os.lstat(new_name, dir_fd=fd1)
@@ -368,6 +554,10 @@ class OverlayFS(BaseFS): # type: ignore
         finally:
             close_no_exc(fd1)
 
+        self.drop_dir_childs(self.get_entry_by_id(source.parent_id))
+        self.drop_dir_childs(to_dir)
+        self.close_fds(source)
+
         entry = self.create_fsentry(to_dir.fs_source, new_name, parent=to_dir, fstat=st)
         self.track_entry(entry)
 
@@ -380,11 +570,12 @@ class OverlayFS(BaseFS): # type: ignore
         self._verify_name(name)
         self._verify_writable()
 
-        path = os.path.join(dest.fs_source, name)
-
         try:
             fd = -1
-            fd = os.open(path, os.O_WRONLY|os.O_CREAT|os.O_EXCL|os.O_NOFOLLOW|os.O_NOCTTY)
+            dirfd = -1
+            dirfd = os.open(dest.fs_source, DIRFD_FLAGS)
+
+            fd = os.open(name, os.O_WRONLY|os.O_CREAT|os.O_EXCL|os.O_NOFOLLOW|os.O_NOCTTY, dir_fd=dirfd)
             set_fd_attrs(fd, attrs)
             st = os.fstat(fd)
 
@@ -395,6 +586,9 @@ class OverlayFS(BaseFS): # type: ignore
             raise FSException(NFSError.ERR_IO) from exc
         finally:
             close_no_exc(fd)
+            close_no_exc(dirfd)
+
+        self.drop_dir_childs(dest)
 
         entry = self.create_fsentry(dest.fs_source, name, parent=dest, fstat=st)
         self.track_entry(entry)
@@ -416,6 +610,8 @@ class OverlayFS(BaseFS): # type: ignore
             logger.critical("Unexpected exception in rm(): %s", repr(exc))
             raise FSException(NFSError.ERR_IO) from exc
 
+        self.drop_dir_childs(self.get_entry_by_id(entry.parent_id))
+        self.close_fds(entry)
         self.remove_entry(entry)
 
     def read(self, entry: FSEntry, offset: int, count: int) -> bytes:
@@ -427,19 +623,18 @@ class OverlayFS(BaseFS): # type: ignore
             raise FSException(NFSError.ERR_IO)
 
         try:
-            fd = -1
-            fd = os.open(entry.fs_source, os.O_RDONLY|os.O_NOFOLLOW|os.O_NOCTTY)
-            res = os.pread(fd, count, offset)
+            fd = self.open_fd(entry, os.O_RDONLY|os.O_NOFOLLOW|os.O_NOCTTY)
+            st = os.fstat(fd)
+            res = self.read_ahead(entry, fd, st, offset, count)
 
-            fill_fsentry(entry, os.fstat(fd))
+            fill_fsentry(entry, st)
 
         except OSError as exc:
+            self.close_fds(entry)
             raise FSException(nfserror_from_errno(exc.errno), exc.strerror) from exc
         except Exception as exc:
             logger.critical("Unexpected exception in read(): %s", repr(exc))
             raise FSException(NFSError.ERR_IO) from exc
-        finally:
-            close_no_exc(fd)
 
         return res
 
@@ -452,9 +647,12 @@ class OverlayFS(BaseFS): # type: ignore
         if entry.type != FileType.REG:
             raise FSException(NFSError.ERR_IO, "Not a regular file!")
 
+        # Writers are not cached: an open writer on the host keeps the file
+        # busy (ETXTBSY, no IN_CLOSE_WRITE) and pins deleted inodes.
         try:
             fd = -1
             fd = os.open(entry.fs_source, os.O_WRONLY|os.O_NOFOLLOW|os.O_NOCTTY)
+            self.readahead.pop(entry.fileid, None)
             res = os.pwrite(fd, data, offset)
 
             fill_fsentry(entry, os.fstat(fd))
@@ -497,15 +695,12 @@ class OverlayFS(BaseFS): # type: ignore
 
         try:
             fd1 = -1
-            fd1 = os.open(dest.fs_source, os.O_DIRECTORY|os.O_NOFOLLOW|os.O_NOCTTY)
+            fd1 = os.open(dest.fs_source, DIRFD_FLAGS)
 
             os.symlink(val, name, dir_fd=fd1)
 
-            fd2 = -1
-            fd2 = os.open(name, os.O_NOFOLLOW|os.O_NOCTTY, dir_fd=fd1)
-
-            set_fd_attrs(fd2, attrs)
-            st = os.fstat(fd2)
+            set_link_attrs(name, fd1, attrs)
+            st = os.lstat(name, dir_fd=fd1)
 
         except OSError as exc:
             raise FSException(nfserror_from_errno(exc.errno), exc.strerror) from exc
@@ -514,7 +709,8 @@ class OverlayFS(BaseFS): # type: ignore
             raise FSException(NFSError.ERR_IO) from exc
         finally:
             close_no_exc(fd1)
-            close_no_exc(fd2)
+
+        self.drop_dir_childs(dest)
 
         entry = self.create_fsentry(dest.fs_source, name, parent=dest, fstat=st)
         self.track_entry(entry)
@@ -527,6 +723,9 @@ class OverlayFS(BaseFS): # type: ignore
         self._verify_owned(entry)
         self._verify_writable()
 
+        # Access to the file may change, so files are reopened.
+        self.close_fds(entry)
+
         try:
             fd = -1
             fd = os.open(entry.fs_source, os.O_WRONLY|os.O_NOFOLLOW|os.O_NOCTTY)
@@ -544,31 +743,53 @@ class OverlayFS(BaseFS): # type: ignore
 
 
 class OverlayFileHandleEncoder(abc.ABC):
-    """64bit FSID and FileID preceded by 128 or 256bit HMAC"""
+    """64bit FSID and FileID preceded by 128 or 256bit keyed BLAKE2b MAC"""
 
     def __init__(self, hmac_secret: bytes) -> None:
         self.hmac_secret = hmac_secret
 
+        # BLAKE2b has a keyed mode of its own, so no HMAC construction is
+        # needed. Its key is limited to 64 bytes.
+        key = hmac_secret
+        if len(key) > 64:
+            key = hashlib.blake2b(key).digest()
+
+        self.mac_v2 = hashlib.blake2b(key=key, digest_size=self._mac_len(True))
+        self.mac_v3 = hashlib.blake2b(key=key, digest_size=self._mac_len(False))
+
+        self.fh_cache: Dict[Tuple[int, int, bool], bytes] = {}
+
     @staticmethod
     def _mac_len(nfs_v2: bool = False) -> int:
         return 16 if nfs_v2 else 32
 
     def _calc_mac(self, data: bytes, nfs_v2: bool = False) -> bytes:
-        # Truncated sha256 isn't recommended, but fine for our purposes.
-        # We're limited to 32 byte FHs if we want to support NFSv2 so
-        # we don't really have a choice.
-        digest = hmac.new(self.hmac_secret, data, 'sha256').digest()
+        # We're limited to 32 byte FHs if we want to support NFSv2, so the
+        # NFSv2 MAC is 128bit.
+        mac = (self.mac_v2 if nfs_v2 else self.mac_v3).copy()
+        mac.update(data)
 
-        return digest[:self._mac_len(nfs_v2)]
+        return mac.digest()
 
     def encode(self, entry: Union[FSEntry, DecodedFileHandle], nfs_v2: bool = False) -> bytes:
-        payload = struct.pack("!QQ", entry.fileid, entry.fsid)
+        key = (entry.fileid, entry.fsid, nfs_v2)
 
-        return self._calc_mac(payload, nfs_v2) + payload
+        if (fh := self.fh_cache.get(key)) is not None:
+            return fh
+
+        payload = FH_STRUCT.pack(entry.fileid, entry.fsid)
+        fh = self._calc_mac(payload, nfs_v2) + payload
+
+        # The handle only depends on the key, so the oldest one is dropped.
+        if len(self.fh_cache) >= FH_CACHE_SIZE:
+            del self.fh_cache[next(iter(self.fh_cache))]
+
+        self.fh_cache[key] = fh
+        return fh
 
     def decode(self, fh: bytes, nfs_v2: bool = False) -> DecodedFileHandle:
         mac_len = self._mac_len(nfs_v2)
-        expected_len = 16 + mac_len
+        expected_len = FH_STRUCT.size + mac_len
 
         if len(fh) != expected_len:
             raise FSException(NFSError.ERR_IO, f"FH {fh!r} is not {expected_len} bytes")
@@ -578,7 +799,7 @@ class OverlayFileHandleEncoder(abc.ABC):
         if not secrets.compare_digest(mac, self._calc_mac(payload, nfs_v2)):
             raise FSException(NFSError.ERR_IO, f"FH {fh!r} failed sig check")
 
-        return DecodedFileHandle(*struct.unpack("!QQ", payload))
+        return DecodedFileHandle(*FH_STRUCT.unpack(payload))
 
 
 async def main(rootfs: bytes,
@@ -613,4 +834,16 @@ async def main(rootfs: bytes,
 def thread(rootfs: bytes,
            mountpoints: Dict[bytes, bytes],
            nfsport: int) -> None:
-    asyncio.run(main(rootfs, mountpoints, nfsport))
+    coro = main(rootfs, mountpoints, nfsport)
+
+    try:
+        import uvloop # type: ignore[import-not-found,unused-ignore]
+    except ImportError:
+        asyncio.run(coro)
+    else:
+        # uvloop.run() appeared in 0.18.
+        if hasattr(uvloop, "run"):
+            uvloop.run(coro)
+        else:
+            uvloop.install()
+            asyncio.run(coro)
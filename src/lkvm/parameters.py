@@ -4,13 +4,17 @@
 import os
 import platform
 import argparse
+import functools
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable
 
 import lkvm.qemu
 
 
 class Parameter:
+    __slots__ = ("name", "cmdline", "confname", "action", "qemu_arg", "desc", "dest",
+                 "default_fn", "default_value")
+
     def __init__(self,
                  name: str,
                  cmdline: Optional[str],
@@ -25,11 +29,23 @@ class Parameter:
         self.action   = action
         self.qemu_arg = qemu_arg
         self.desc     = desc
+        self.dest     = f"qemu_{name}"
+
+        self.default_fn: Optional[Callable[[], Any]] = None
+        self.default_value: Any = None
 
         if callable(default):
-            self.default = default.__call__()
+            self.default_fn = default
         else:
-            self.default = default
+            self.default_value = default
+
+
+    @property
+    def default(self) -> Any:
+        if self.default_fn is not None:
+            self.default_value = self.default_fn()
+            self.default_fn = None
+        return self.default_value
 
 
     def add_arguments(self, parser: argparse.ArgumentParser) -> None:
@@ -38,17 +54,15 @@ class Parameter:
 
         args = [ f"--{self.cmdline}" ]
 
+        default = self.default
+
         kwargs: Dict[str, Any] = {
-            'dest'    : f"qemu_{self.name}",
+            'dest'    : self.dest,
             'action'  : self.action,
-            'help'    : self.desc,
+            'help'    : f"{self.desc} (default: {default})." if default else f"{self.desc}.",
             'default' : None,
         }
 
-        if self.default:
-            kwargs['help'] += f' (default: {self.default})'
-        kwargs['help'] += '.'
-
         if self.action not in ('store_true', 'store_false'):
             kwargs["metavar"] = self.name.upper()
 
@@ -63,7 +77,7 @@ class Parameter:
             config[self.confname] = self.default
 
         try:
-            value = getattr(args, f"qemu_{self.name}")
+            value = getattr(args, self.dest)
 
             if value is not None:
                 config[self.confname] = value
@@ -76,6 +90,7 @@ def detect_kvm() -> bool:
     return os.access("/dev/kvm", os.R_OK)
 
 
+@functools.cache
 def detect_arch() -> str:
     return os.uname().machine
 
@@ -96,13 +111,9 @@ def detect_cpu() -> str:
     return 'kvm32'
 
 
+@functools.cache
 def detect_cpus() -> int:
-    try:
-        import multiprocessing
-        return multiprocessing.cpu_count()
-    except ModuleNotFoundError:
-        pass
-    return 1
+    return os.cpu_count() or 1
 
 
 def detect_memory() -> str:
@@ -157,7 +168,7 @@ PARAMS = [
               confname = 'enable-kvm',
               action   = 'store_true',
               default  = detect_kvm,
-              qemu_arg = lkvm.qemu.arg_simple,
+              qemu_arg = lkvm.qemu.arg_simple_bool,
               desc     = 'Enables KVM full virtualization support'),
 
     Parameter(name     = 'memory',
@@ -237,7 +248,7 @@ PARAMS = [
               confname = 'object',
               action   = 'append',
               default  = [],
-              qemu_arg = lkvm.qemu.arg_simple,
+              qemu_arg = lkvm.qemu.arg_simple_list,
               desc     = 'Adds a new object of type typename setting properties in the order they are specified'),
 
     Parameter(name     = 'device',
@@ -245,7 +256,7 @@ PARAMS = [
               confname = 'device',
               action   = 'append',
               default  = [],
-              qemu_arg = lkvm.qemu.arg_simple,
+              qemu_arg = lkvm.qemu.arg_simple_list,
               desc     = 'Adds device driver and sets driver properties'),
 
     Parameter(name     = 'nfsport',
@@ -306,3 +317,5 @@ PARAMS = [
 ]
 
 CONFNAMES = [ p.confname for p in PARAMS ]
+CONFACTIONS = { p.confname: p.action for p in PARAMS }
+ACTIVE_PARAMS = [ p for p in PARAMS if p.confname and p.qemu_arg ]
@@ -4,6 +4,7 @@
 import os
 import re
 import sys
+import functools
 
 from typing import Dict, List, Any
 
@@ -14,7 +15,10 @@ import lkvm.kernel
 logger = lkvm.logger
 serial = 0
 
+RE_DEBUGGER_SOCKET = re.compile(r".*,socket=(?P<socket>[^,]+)")
 
+
+@functools.cache
 def executable(arch: str) -> str | lkvm.Error:
     exe = f"qemu-system-{arch}"
     ecode, _, _ = lkvm.run_command([exe, "-version"])
@@ -24,26 +28,33 @@ def executable(arch: str) -> str | lkvm.Error:
 
     return exe
 
+@functools.cache
+def terminal_size() -> os.terminal_size:
+    try:
+        return os.get_terminal_size()
+    except OSError:
+        # stdout is not a terminal.
+        return os.terminal_size((80, 24))
+
 def arg_simple(key: str, config: Dict[str, Any]) -> List[str]:
     value = config[key]
 
-    if isinstance(value, list):
-        ret = []
-        for arg in value:
-            ret.extend([f"-{key}", str(arg)])
-        return ret
-
-    if isinstance(value, bool):
-        ret = []
-        if value:
-            ret = [f"-{key}"]
-        return ret
-
     if value:
         return [f"-{key}", str(value)]
 
     return []
 
+def arg_simple_list(key: str, config: Dict[str, Any]) -> List[str]:
+    ret = []
+    for arg in config[key]:
+        ret.extend([f"-{key}", str(arg)])
+    return ret
+
+def arg_simple_bool(key: str, config: Dict[str, Any]) -> List[str]:
+    if config[key]:
+        return [f"-{key}"]
+    return []
+
 def arg_no_simple(key: str, config: Dict[str, Any]) -> List[str]:
     if not config[key]:
         return [f"-no-{key}"]
@@ -69,8 +80,10 @@ def arg_virtfs(key: str, config: Dict[str, Any]) -> List[str]:
     for i, virtfs in enumerate(value):
         if "," in virtfs:
             ret.extend(["-virtfs", virtfs])
-        elif ":" in virtfs:
-            path, tag = virtfs.split(":", 1)
+            continue
+
+        path, sep, tag = virtfs.partition(":")
+        if sep:
             ret.extend(["-virtfs", f"local,id=virtfs-{i},path={path},security_model=none,mount_tag={tag},multidevs=remap"])
 
     return ret
@@ -81,15 +94,8 @@ def arg_disk(key: str, config: Dict[str, Any]) -> List[str]:
     if not isinstance(value, list):
         return []
 
-    ret: List[str] = []
-
-    for disk in value:
-        if "," in disk:
-            ret.extend(["-drive", disk])
-        else:
-            ret.extend(["-drive", f"file={disk},if=virtio,cache=writeback"])
-
-    return ret
+    return [ arg for disk in value
+             for arg in ("-drive", disk if "," in disk else f"file={disk},if=virtio,cache=writeback") ]
 
 def arg_random(key: str, config: Dict[str, Any]) -> List[str]:
     value = config[key]
@@ -97,21 +103,21 @@ def arg_random(key: str, config: Dict[str, Any]) -> List[str]:
     if value == "none":
         return []
 
+    kind, sep, data = value.partition(",")
+
     # random=virtio,/dev/random
-    if value.startswith("virtio,/"):
-        data = value[len("virtio,"):]
+    if kind == "virtio" and data.startswith("/"):
         return [
             "-object", f"rng-random,filename={data},id=rng0",
             "-device", "virtio-rng-pci,rng=rng0",
         ]
 
     # random=egd,host=10.66.4.212,port=1024
-    if value.startswith("egd,"):
-        data = value[len("egd,"):]
+    if kind == "egd" and sep:
         return [
-			"-chardev", f"socket,id=chr0,${data}",
+            "-chardev", f"socket,id=chr0,{data}",
             "-object", "rng-egd,chardev=chr0,id=rng0",
-			"-device", "virtio-rng-pci,rng=rng0",
+            "-device", "virtio-rng-pci,rng=rng0",
         ]
 
     logger.critical("BUG: Unknown random type: %s", value)
@@ -138,11 +144,13 @@ def arg_monitor(key: str, config: Dict[str, Any]) -> List[str]:
     if value == "none":
         return ["-monitor", "none"]
 
-    if value.startswith("qmp:"):
-        return ["-qmp", value[len("qmp:"):]]
+    kind, sep, data = value.partition(":")
+
+    if kind == "qmp" and sep:
+        return ["-qmp", data]
 
-    if value.startswith("monitor:"):
-        return ["-monitor", value[len("monitor:"):]]
+    if kind == "monitor" and sep:
+        return ["-monitor", data]
 
     return []
 
@@ -157,7 +165,7 @@ def arg_console(key: str, config: Dict[str, Any]) -> List[str]:
     ret: List[str] = []
 
     if value == "serial":
-        (columns, lines) = os.get_terminal_size()
+        (columns, lines) = terminal_size()
 
         lkvm.kernel.CMDLINE["winsize"] = f"{lines}x{columns}"
         lkvm.kernel.CMDLINE["console"] = f"ttyS{serial}"
@@ -196,16 +204,16 @@ def arg_network(key: str, config: Dict[str, Any]) -> List[str]:
     ret: List[str] = []
 
     for v in value:
-        if v == "none":
+        kind, sep, data = v.partition(",")
+
+        if kind == "none" and not sep:
             ret.extend(["-net", "none"])
 
-        elif v == "user" or v.startswith("user,"):
+        elif kind == "user":
             # user,model=virtio-net-pci
-            data = v[len("user"):]
-            ret.extend(["-nic", f"user{data}"])
+            ret.extend(["-nic", f"user{sep}{data}"])
 
-        elif v.startswith("netdev,"):
-            data = v[len("netdev,"):]
+        elif kind == "netdev" and sep:
             ret.extend(["-netdev", data])
 
         else:
@@ -226,7 +234,7 @@ def arg_debugger(key: str, config: Dict[str, Any]) -> List[str]:
 
     socket = '${profile}/gdb-socket'
 
-    if m := re.match(r".*,socket=(?P<socket>[^,]+)", value):
+    if m := RE_DEBUGGER_SOCKET.match(value):
         socket = m.group("socket")
 
     if value == "none":
@@ -275,10 +283,10 @@ def arg_kernel(key: str, config: Dict[str, Any]) -> List[str]:
     if not value:
         return []
 
-    if value == "find" or value.startswith("find,"):
-        if value.startswith("find,"):
-            path = value[len("find,"):]
-        else:
+    kind, sep, path = value.partition(",")
+
+    if kind == "find":
+        if not sep:
             path = os.getcwd()
 
         if img := lkvm.kernel.find_image(path, os.environ):
@@ -292,16 +300,15 @@ def arg_kernel(key: str, config: Dict[str, Any]) -> List[str]:
 
 def arg_cmdline(key: str, config: Dict[str, Any]) -> List[str]:
     value = config[key]
+    cmdline = lkvm.kernel.CMDLINE
 
     if value:
-        for param in value.split(" "):
-            if m := re.match(r"^(?P<name>[^=]+)=(?P<value>.*)", param):
-                if m.group("value"):
-                    lkvm.kernel.CMDLINE[m.group("name")] = m.group("value")
-                else:
-                    lkvm.kernel.CMDLINE[m.group("name")] = None
+        for param in value.split():
+            name, sep, val = param.partition("=")
+            if sep and name:
+                cmdline[name] = val or None
             else:
-                lkvm.kernel.CMDLINE[param] = True
+                cmdline[param] = True
 
     required_params: Dict[str, Any] = {}
     optional_params: Dict[str, Any] = {}
@@ -325,50 +332,49 @@ def arg_cmdline(key: str, config: Dict[str, Any]) -> List[str]:
         optional_params["ip"]          = "dhcp"
 
     for k, v in required_params.items():
-        lkvm.kernel.CMDLINE[k] = v
+        cmdline[k] = v
 
     for k, v in optional_params.items():
-        if k not in lkvm.kernel.CMDLINE:
-            lkvm.kernel.CMDLINE[k] = v
+        if k not in cmdline:
+            cmdline[k] = v
 
-    # pylint: disable-next=consider-using-dict-items
-    for k in lkvm.kernel.CMDLINE.keys():
-        v = lkvm.kernel.CMDLINE[k]
+    for k, v in cmdline.items():
+        if isinstance(v, str) and "${" in v:
+            cmdline[k] = lkvm.config.expandvars_string(config, v)
 
-        if isinstance(v, str):
-            lkvm.kernel.CMDLINE[k] = lkvm.config.expandvars_string(config, v)
-
-    if len(lkvm.kernel.CMDLINE) > 0:
-        return ["-append", lkvm.kernel.CMDLINE.join()]
+    if len(cmdline) > 0:
+        return ["-append", cmdline.join()]
 
     return []
 
 def arg_unknown(key: str, config: Dict[str, Any]) -> List[str]:
-    ret: List[str] = []
     value = config[key]
 
-    if isinstance(value, list):
-        for v in value:
-            ret.extend(v.split())
+    if not isinstance(value, list):
+        return []
 
-    return ret
+    return [ arg for v in value for arg in v.split() ]
 
 
 def dump(a: List[str]) -> None:
     is_option = False
     prev_is_option = False
 
+    parts: List[str] = []
+
     for v in a:
         is_option = v.startswith("-")
 
         if is_option:
-            print(("\\\n" if prev_is_option else ""), "\t", v, " ", sep='', end='')
+            parts.extend(["\\\n" if prev_is_option else "", "\t", v, " "])
         else:
-            print("'", v, "' \\\n", sep='', end='')
+            parts.extend(["'", v, "' \\\n"])
 
         prev_is_option = is_option
 
     if is_option:
-        print(" \\\n", sep='', end='')
+        parts.append(" \\\n")
+
+    parts.append("\t#\n")
 
-    print("\t#")
+    sys.stdout.write("".join(parts))